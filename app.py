@@ -1,3 +1,6 @@
+import hashlib
+import io
+
 import streamlit as st
 import pandas as pd
 import numpy as np
@@ -7,37 +10,128 @@ st.set_page_config(page_title="Video Usage Dashboard", layout="wide")
 
 st.title("📊 Video Usage & Suspicious Activity Dashboard")
 
+# Columns the dashboard reads; anything else in the export is skipped at parse time
+USED_COLS = [
+    "user_id", "device_id", "date", "lesson_id", "_subject_title",
+    "content_id", "content_type", "category", "sub_category", "alert_level", "alert_type", "message",
+]
+
+# Above this many users the picker narrows by typed prefix instead of listing everyone
+MAX_USER_OPTIONS = 1000
+
+# Per-user/device/day grain shared by the License and Lesson Tests tabs
+DAILY_KEYS = ["user_id", "device_id", "date"]
+
+# Column dtypes applied right after the read: ID/label columns are categorical so groupby/equality
+# run on integer codes; free text stays in Arrow string buffers instead of one Python object per cell.
+# (Not passed as read_csv's dtype=: on pandas 3 any dtype mapping makes the pyarrow engine fail on
+# integer columns with empty cells, e.g. a blank epoch "date")
+DTYPES = {
+    "user_id": "category", "device_id": "category", "lesson_id": "category",
+    "content_id": "category", "_subject_title": "category",
+    "content_type": "category", "category": "category", "sub_category": "category",
+    "alert_level": "category", "alert_type": "category",
+    "message": "string[pyarrow]",
+}
+
+# Collapse the tail of a count Series into one "Other" slice so pies stay readable/light
+def top_slices(counts, n=20):
+    counts = counts.sort_values(ascending=False)
+    if len(counts) <= n:
+        return counts
+    other = pd.Series([counts.iloc[n:].sum()], index=["Other"])
+    return pd.concat([counts.iloc[:n], other])
+
+# --- Load & prep (cached per upload, keyed on the file's SHA-1; the bytes themselves aren't re-hashed) ---
+# cache_resource hands every rerun the same frame without a pickle round-trip,
+# so the returned frame must never be mutated (filters below only select/slice)
+@st.cache_resource(show_spinner=False)
+def load_and_prep(file_key: str, _file_bytes: bytes) -> pd.DataFrame:
+    header = pd.read_csv(io.BytesIO(_file_bytes), nrows=0).columns
+    
+    # --- Normalized names: one raw header per used column, renamed in a single pass ---
+    names = (header.str.strip().str.lower()
+             .str.replace("-", "_", regex=False).str.replace(" ", "_", regex=False))
+    raw_by_name = {}
+    for col, name in zip(header, names):
+        raw_by_name.setdefault(name, col)
+    mapping = {raw: name for name, raw in raw_by_name.items() if name in USED_COLS}
+    
+    df = pd.read_csv(io.BytesIO(_file_bytes), engine="pyarrow", usecols=list(mapping))
+    df.rename(columns=mapping, inplace=True)
+    df = df.astype({col: DTYPES[col] for col in df.columns if col in DTYPES})
+    
+    # --- Convert dates (only "date" is filtered/plotted; other timestamps stay unread) ---
+    df["date"] = pd.to_datetime(pd.to_numeric(df["date"], errors="coerce"), unit="ms", origin="unix")
+    
+    # --- Date-ordered rows so range filters are a binary-search slice ---
+    # (undated rows never pass the Date Range filter, so drop them here)
+    return df.dropna(subset=["date"]).sort_values("date", kind="stable", ignore_index=True)
+
+# --- Daily aggregates (cached per upload, filtered afterwards) ---
+# "date" holds full epoch timestamps, so this has about as many rows as the upload itself;
+# like load_and_prep it is served by cache_resource and must never be mutated (tabs only mask/copy it)
+@st.cache_resource(show_spinner=False)
+def build_daily(file_key: str, _df: pd.DataFrame) -> pd.DataFrame:
+    # Sort once on the group keys so the groupby can skip re-sorting
+    df = _df.sort_values(DAILY_KEYS, kind="stable")
+    # One groupby over the shared keys feeds both the License and Lesson Tests tabs
+    return df.assign(
+        qbank_content=df["content_id"].where(df["content_type"]=="lesson"),
+        test_content=df["content_id"].where(df["content_type"]=="test"),
+    ).groupby(DAILY_KEYS, sort=False, observed=True).agg(
+        license_count=("lesson_id","nunique"),
+        subjects=("_subject_title","nunique"),
+        qbank_submits=("qbank_content","nunique"),
+        test_submits=("test_content","nunique"),
+    ).astype("int32").reset_index()
+
+# --- String labels for the user picker's prefix search (built once per upload) ---
+@st.cache_resource(show_spinner=False)
+def user_labels(file_key: str, _users: pd.Index) -> pd.Index:
+    return _users.astype(str)
+
 # --- Upload CSV ---
 uploaded_file = st.file_uploader("Upload joined dataset", type=["csv"])
 if uploaded_file:
-    df = pd.read_csv(uploaded_file)
-    
-    # --- Convert dates ---
-    for col in ["created_on", "submitted_on", "date"]:
-        if col in df.columns:
-            df[col] = pd.to_datetime(df[col], errors="coerce", unit="ms", origin="unix")
+    file_bytes = uploaded_file.getvalue()
+    file_key = hashlib.sha1(file_bytes).hexdigest()
+    df = load_and_prep(file_key, file_bytes)
+    daily_all = build_daily(file_key, df)
     
     # --- Filters ---
-    users = df["user_id"].dropna().unique()
-    selected_user = st.sidebar.selectbox("Select User", options=["All"]+list(users))
+    # Categories are already the distinct, sorted, non-null user ids
+    users = df["user_id"].cat.categories
+    if len(users) > MAX_USER_OPTIONS:
+        typed = st.sidebar.text_input("Search User (id prefix)")
+        user_options = users[user_labels(file_key, users).str.startswith(typed)][:50]
+    else:
+        user_options = users
+    selected_user = st.sidebar.selectbox("Select User", options=["All"]+list(user_options))
     date_min, date_max = df["date"].min(), df["date"].max()
     date_range = st.sidebar.date_input("Date Range", [date_min, date_max])
     
-    # Apply filters
-    mask = (df["date"].between(date_range[0], date_range[1]))
+    # Apply filters (raw rows for the log/meta tabs, pre-aggregated rows for the rest)
+    # date holds full timestamps, so the selected end day runs up to (not including) the next midnight
+    d0 = pd.Timestamp(date_range[0])
+    d1_excl = pd.Timestamp(date_range[1]) + pd.Timedelta(days=1)
+    lo = df["date"].searchsorted(d0, side="left")
+    hi = df["date"].searchsorted(d1_excl, side="left")
+    fdf = df.iloc[lo:hi]
+    daily_mask = (daily_all["date"] >= d0) & (daily_all["date"] < d1_excl)
     if selected_user != "All":
-        mask &= (df["user_id"] == selected_user)
-    fdf = df[mask]
+        # Both frames share the loader's user_id categories, so compare integer codes
+        user_code = users.get_loc(selected_user)
+        fdf = fdf[fdf["user_id"].cat.codes.to_numpy() == user_code]
+        daily_mask &= (daily_all["user_id"].cat.codes.to_numpy() == user_code)
+    daily = daily_all[daily_mask]
     
     # --- Tabs ---
     tab1, tab2, tab3, tab4 = st.tabs(["License", "Lesson Tests", "Suspicious Logs", "Video Meta"])
     
     with tab1:
         st.subheader("License Metrics")
-        license_df = fdf.groupby(["user_id","device_id","date"]).agg(
-            license_count=("lesson_id","nunique"),
-            subjects=(" _subject_title","nunique")
-        ).reset_index()
+        license_df = daily[DAILY_KEYS + ["license_count","subjects"]].copy()
         
         license_df["repeat_day"] = np.where(license_df["license_count"] > 10, 1, 0)
         
@@ -46,10 +140,8 @@ if uploaded_file:
     
     with tab2:
         st.subheader("Lesson Test Submissions")
-        submissions = fdf.groupby(["user_id","device_id","date"]).agg(
-            qbank_submits=("content_id", lambda x: x[fdf["content_type"]=="lesson"].nunique()),
-            test_submits=("content_id", lambda x: x[fdf["content_type"]=="test"].nunique())
-        ).reset_index()
+        submit_cols = ["qbank_submits","test_submits"]
+        submissions = daily.loc[daily[submit_cols].any(axis=1), DAILY_KEYS + submit_cols]
         
         st.dataframe(submissions)
         st.plotly_chart(px.bar(submissions, x="date", y=["qbank_submits","test_submits"]))
@@ -62,6 +154,8 @@ if uploaded_file:
     
     with tab4:
         st.subheader("Video Meta")
-        meta = fdf.groupby("_subject_title").agg(lessons=("lesson_id","nunique")).reset_index()
+        lessons = fdf.groupby("_subject_title", observed=True)["lesson_id"].nunique()
+        meta = lessons.reset_index(name="lessons")
+        pie = top_slices(lessons).rename_axis("_subject_title").reset_index(name="lessons")
         st.dataframe(meta)
-        st.plotly_chart(px.pie(meta, names="_subject_title", values="lessons"))
+        st.plotly_chart(px.pie(pie, names="_subject_title", values="lessons"))
@@ -1,3 +1,7 @@
+import hashlib
+import io
+from concurrent.futures import ThreadPoolExecutor
+
 import streamlit as st
 import pandas as pd
 import numpy as np
@@ -24,26 +28,129 @@ lesson_test_file = st.sidebar.file_uploader("Lesson Test Submissions CSV", type=
 video_meta_file = st.sidebar.file_uploader("Video Meta CSV", type=['csv'])
 suspicious_activity_file = st.sidebar.file_uploader("Suspicious Activity Logs CSV", type=['csv'])
 
-# Load data function
-@st.cache_data
-def load_data(file):
+# Column dtypes applied right after the read (to whichever of these columns a file has).
+# Not passed as read_csv's dtype=: on pandas 3 any dtype mapping makes the pyarrow engine
+# fail on integer columns with empty cells (e.g. content_sub_type on test submits)
+DTYPES = {
+    'user_id': 'category', 'device_id': 'category', 'video_id': 'category', 'course_id': 'category',
+    'lesson_id': 'category', 'content_id': 'category', '_subject_title': 'category',
+    'content_type': 'category', 'alert_level': 'category', 'category': 'category',
+    'message': 'string[pyarrow]',
+}
+
+# Columns read from each file: everything the tabs and "Raw ... Data" previews use
+# (the exports are much wider; other columns are never parsed)
+FILE_COLS = {
+    'license': ['date', 'user_id', 'device_id', 'video_id', 'course_id'],
+    'lesson': ['submitted_on', 'user_id', 'device_id', 'content_id', 'content_type', 'content_sub_type'],
+    'meta': ['lesson_id', '_subject_title', '_duration'],
+    'suspicious': ['date', 'user_id', 'category', 'sub_category', 'alert_level', 'alert_type', 'message'],
+}
+
+# Load data function (parsed frame is cached per upload, keyed on the file's SHA-1).
+# cache_resource hands every rerun the same frame without a pickle round-trip,
+# so the returned frames must never be mutated; everything below only reads them
+@st.cache_resource(show_spinner=False)
+def load_data(file_key, _file_bytes, kind, date_col=None, unit=None):
+    header = pd.read_csv(io.BytesIO(_file_bytes), nrows=0).columns
+    usecols = [c for c in header if c in FILE_COLS[kind]]
+    # String dates are parsed by the pyarrow reader itself; epoch columns still need a unit
+    parse_dates = [date_col] if date_col is not None and unit is None else None
+    df = pd.read_csv(io.BytesIO(_file_bytes), engine='pyarrow', usecols=usecols, parse_dates=parse_dates)
+    df = df.astype({c: t for c, t in DTYPES.items() if c in df.columns})
+    if unit is not None:
+        df[date_col] = pd.to_datetime(pd.to_numeric(df[date_col], errors='coerce'), unit=unit)
+    return df
+
+# Returns (SHA-1 of the upload, parsed frame); the digest is computed once and reused as
+# the cache key everywhere, so Streamlit never hashes the raw bytes itself
+def read_upload(file, kind, date_col=None, unit=None):
     if file is not None:
-        return pd.read_csv(file)
-    return None
+        file_bytes = file.getvalue()
+        file_key = hashlib.sha1(file_bytes).hexdigest()
+        return file_key, load_data(file_key, file_bytes, kind, date_col, unit)
+    return None, None
+
+def show_raw(df, rows=100):
+    # Frames are already projected to FILE_COLS at load time
+    st.dataframe(df.head(rows), hide_index=True)
+
+# Collapse the tail of a count Series into one "Other" slice so pies stay readable/light
+def top_slices(counts, n=20):
+    counts = counts.sort_values(ascending=False)
+    if len(counts) <= n:
+        return counts
+    other = pd.Series([counts.iloc[n:].sum()], index=['Other'])
+    return pd.concat([counts.iloc[:n], other])
+
+# Per-tab aggregations (pure pandas, safe to run off the script thread)
+# Named aggregations per (device, user); one grouping serves both the videos and the subjects charts
+def count_videos_per_device(license_df):
+    aggs = {'unique_videos': ('video_id', 'nunique'), 'unique_days': ('date', 'nunique')}
+    # course_id is the only optional column; video_id and date are required
+    if 'course_id' in license_df.columns:
+        aggs['unique_subjects'] = ('course_id', 'nunique')
+    return license_df.groupby(['device_id', 'user_id'], observed=True).agg(**aggs).reset_index()
+
+def count_high_frequency_days(license_df, threshold=10):
+    # Mask rows by their (user, day) group size instead of building a per-day frame
+    day_size = license_df.groupby(['user_id', 'date'], observed=True)['date'].transform('size')
+    return license_df.loc[day_size > threshold].groupby('user_id', observed=True)['date'].nunique().reset_index(name='high_frequency_days')
+
+# Convert the SQL logic to Python
+def analyze_test_submissions(lesson_df):
+    # Only the grouping columns are materialized; the original frame is left untouched
+    # (submit_date is a native datetime64 day bucket; submitted_on is parsed by the loader)
+    df = lesson_df[['user_id', 'device_id', 'content_id']].assign(
+        submit_date=lesson_df['submitted_on'].dt.normalize()
+    )
+    
+    # Qbank submits (content_type = 'lesson' AND content_sub_type = '1')
+    # Numeric compare so '1', 1 and 1.0 all match however the reader typed the column
+    sub_type_is_one = pd.to_numeric(lesson_df['content_sub_type'], errors='coerce').eq(1)
+    qbank_mask = (lesson_df['content_type'] == 'lesson') & sub_type_is_one
+    qbank_submits = df[qbank_mask].groupby(['user_id', 'device_id', 'submit_date'], observed=True)['content_id'].nunique().rename('qbank_submits')
+    
+    # Test submits (content_type = 'test' AND content_sub_type IS NULL)
+    test_mask = (lesson_df['content_type'] == 'test') & (lesson_df['content_sub_type'].isna())
+    test_submits = df[test_mask].groupby(['user_id', 'device_id', 'submit_date'], observed=True)['content_id'].nunique().rename('test_submits')
+    
+    # Align both counts on the shared group keys
+    result = pd.concat([qbank_submits, test_submits], axis=1).fillna(0).astype('int32').reset_index()
+    
+    # For custom module submits, we'd need the custom_module_answer table
+    # Since we don't have it, we'll note this limitation
+    result['cm_submits'] = 0  # Placeholder
+    
+    return result
+
+# All per-tab aggregations, computed once per set of uploads (keyed on the file hashes).
+# They are independent, so they are submitted to a thread pool together;
+# frame arguments are underscore-prefixed so Streamlit doesn't hash them
+@st.cache_data(show_spinner=False)
+def build_tab_aggregates(file_keys, _license_df, _lesson_df, _meta_df, _susp_df):
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        jobs = {
+            'videos_per_device': pool.submit(count_videos_per_device, _license_df),
+            'repeat_counts': pool.submit(count_high_frequency_days, _license_df),
+            'test_analysis': pool.submit(analyze_test_submissions, _lesson_df),
+            'subject_counts': pool.submit(_meta_df['_subject_title'].value_counts),
+            'alert_counts': pool.submit(_susp_df['alert_level'].value_counts),
+        }
+    return {name: job.result() for name, job in jobs.items()}
 
 # Load all datasets
-video_license_df = load_data(video_license_file)
-lesson_test_df = load_data(lesson_test_file)
-video_meta_df = load_data(video_meta_file)
-suspicious_activity_df = load_data(suspicious_activity_file)
+video_license_key, video_license_df = read_upload(video_license_file, 'license', 'date')
+lesson_test_key, lesson_test_df = read_upload(lesson_test_file, 'lesson', 'submitted_on', unit='ms')
+video_meta_key, video_meta_df = read_upload(video_meta_file, 'meta')
+suspicious_activity_key, suspicious_activity_df = read_upload(suspicious_activity_file, 'suspicious', 'date')
 
 # Check if all files are uploaded
 if all(df is not None for df in [video_license_df, lesson_test_df, video_meta_df, suspicious_activity_df]):
     
-    # Convert date columns to datetime
-    video_license_df['date'] = pd.to_datetime(video_license_df['date'])
-    lesson_test_df['submitted_on'] = pd.to_datetime(lesson_test_df['submitted_on'], unit='ms')
-    suspicious_activity_df['date'] = pd.to_datetime(suspicious_activity_df['date'])
+    file_keys = (video_license_key, lesson_test_key, video_meta_key, suspicious_activity_key)
+    aggregates = build_tab_aggregates(file_keys, video_license_df, lesson_test_df,
+                                      video_meta_df, suspicious_activity_df)
     
     # Create tabs for different sections
     tab1, tab2, tab3, tab4 = st.tabs([
@@ -68,8 +175,7 @@ if all(df is not None for df in [video_license_df, lesson_test_df, video_meta_df
         
         with col2:
             st.subheader("Unique Users & Devices")
-            unique_users = video_license_df['user_id'].nunique()
-            unique_devices = video_license_df['device_id'].nunique()
+            unique_users, unique_devices = video_license_df[['user_id', 'device_id']].nunique()
             st.write(f"**Unique Users:** {unique_users}")
             st.write(f"**Unique Devices:** {unique_devices}")
         
@@ -80,11 +186,7 @@ if all(df is not None for df in [video_license_df, lesson_test_df, video_meta_df
         
         # No of videos hit license per device
         st.subheader("Videos per Device Analysis")
-        videos_per_device = video_license_df.groupby(['device_id', 'user_id']).agg({
-            'video_id': 'nunique',
-            'date': 'nunique'
-        }).reset_index()
-        videos_per_device.columns = ['device_id', 'user_id', 'unique_videos', 'unique_days']
+        videos_per_device = aggregates['videos_per_device']
         
         fig1 = px.histogram(videos_per_device, x='unique_videos', 
                            title='Distribution of Unique Videos per Device')
@@ -92,13 +194,9 @@ if all(df is not None for df in [video_license_df, lesson_test_df, video_meta_df
         
         # Repeat Count license (count distinct of date where license count > 10 for that user)
         st.subheader("High-Frequency Users (License Count > 10 per day)")
-        daily_license_count = video_license_df.groupby(['user_id', 'date']).size().reset_index(name='license_count')
-        high_freq_users = daily_license_count[daily_license_count['license_count'] > 10]
+        repeat_counts = aggregates['repeat_counts']
         
-        if not high_freq_users.empty:
-            repeat_counts = high_freq_users.groupby('user_id')['date'].nunique().reset_index()
-            repeat_counts.columns = ['user_id', 'high_frequency_days']
-            
+        if not repeat_counts.empty:
             fig2 = px.bar(repeat_counts, x='user_id', y='high_frequency_days',
                          title='Users with High License Frequency (>10/day)')
             st.plotly_chart(fig2, use_container_width=True)
@@ -109,82 +207,45 @@ if all(df is not None for df in [video_license_df, lesson_test_df, video_meta_df
         
         # Subjects accessed - per device
         st.subheader("Subjects Accessed per Device")
-        if 'course_id' in video_license_df.columns and 'device_id' in video_license_df.columns:
-            subjects_per_device = video_license_df.groupby(['device_id', 'user_id'])['course_id'].nunique().reset_index()
-            subjects_per_device.columns = ['device_id', 'user_id', 'unique_subjects']
-            
-            fig3 = px.box(subjects_per_device, y='unique_subjects', 
+        if 'unique_subjects' in videos_per_device.columns:
+            fig3 = px.box(videos_per_device, y='unique_subjects', 
                          title='Distribution of Unique Subjects per Device')
             st.plotly_chart(fig3, use_container_width=True)
         
         # Display raw data
         st.subheader("Raw Video License Data")
-        st.dataframe(video_license_df.head(100))
+        show_raw(video_license_df)
     
     with tab2:
         st.header("Lesson Test Submissions Analysis")
         
-        # Convert the SQL logic to Python
-        def analyze_test_submissions(lesson_df):
-            # Create a copy to avoid modifying original data
-            df = lesson_df.copy()
-            
-            # Ensure submitted_on is datetime
-            df['submit_date'] = pd.to_datetime(df['submitted_on']).dt.date
-            
-            # Qbank submits (content_type = 'lesson' AND content_sub_type = '1')
-            qbank_mask = (df['content_type'] == 'lesson') & (df['content_sub_type'] == '1')
-            qbank_submits = df[qbank_mask].groupby(['user_id', 'device_id', 'submit_date'])['content_id'].nunique().reset_index()
-            qbank_submits.columns = ['user_id', 'device_id', 'submit_date', 'qbank_submits']
-            
-            # Test submits (content_type = 'test' AND content_sub_type IS NULL)
-            test_mask = (df['content_type'] == 'test') & (df['content_sub_type'].isna())
-            test_submits = df[test_mask].groupby(['user_id', 'device_id', 'submit_date'])['content_id'].nunique().reset_index()
-            test_submits.columns = ['user_id', 'device_id', 'submit_date', 'test_submits']
-            
-            # Merge results
-            result = pd.merge(qbank_submits, test_submits, 
-                            on=['user_id', 'device_id', 'submit_date'], 
-                            how='outer').fillna(0)
-            
-            # For custom module submits, we'd need the custom_module_answer table
-            # Since we don't have it, we'll note this limitation
-            result['cm_submits'] = 0  # Placeholder
-            
-            return result
-        
-        test_analysis_df = analyze_test_submissions(lesson_test_df)
+        test_analysis_df = aggregates['test_analysis']
         
         # Display analysis
         st.subheader("Daily Test Submission Summary")
         
+        submit_cols = ['qbank_submits', 'test_submits']
+        totals = test_analysis_df[submit_cols].sum()
+        
         col1, col2, col3 = st.columns(3)
         with col1:
-            total_qbank = test_analysis_df['qbank_submits'].sum()
-            st.metric("Total QBank Submits", total_qbank)
+            st.metric("Total QBank Submits", totals['qbank_submits'])
         
         with col2:
-            total_test = test_analysis_df['test_submits'].sum()
-            st.metric("Total Test Submits", total_test)
+            st.metric("Total Test Submits", totals['test_submits'])
         
         with col3:
             st.metric("Total Custom Module Submits", "N/A")
         
         # Time series of submissions
-        daily_submissions = test_analysis_df.groupby('submit_date').agg({
-            'qbank_submits': 'sum',
-            'test_submits': 'sum'
-        }).reset_index()
+        daily_submissions = test_analysis_df.groupby('submit_date')[submit_cols].sum().reset_index()
         
         fig = px.line(daily_submissions, x='submit_date', y=['qbank_submits', 'test_submits'],
                      title='Daily Submission Trends', labels={'value': 'Count', 'variable': 'Type'})
         st.plotly_chart(fig, use_container_width=True)
         
         # Top users by submissions
-        top_users = test_analysis_df.groupby('user_id').agg({
-            'qbank_submits': 'sum',
-            'test_submits': 'sum'
-        }).sum(axis=1).sort_values(ascending=False).head(10)
+        top_users = test_analysis_df.groupby('user_id', observed=True)[submit_cols].sum().sum(axis=1).nlargest(10)
         
         fig2 = px.bar(x=top_users.index, y=top_users.values,
                      title='Top 10 Users by Total Submissions')
@@ -192,28 +253,26 @@ if all(df is not None for df in [video_license_df, lesson_test_df, video_meta_df
         
         # Display raw data
         st.subheader("Raw Test Submission Data")
-        st.dataframe(lesson_test_df.head(100))
+        show_raw(lesson_test_df)
     
     with tab3:
         st.header("Video Meta Analysis")
         
-        # Basic stats
+        # Basic stats (one aggregation call for all three metrics)
+        meta_stats = video_meta_df.agg({'lesson_id': 'nunique', '_subject_title': 'nunique', '_duration': 'mean'})
+        
         col1, col2, col3 = st.columns(3)
         with col1:
-            unique_lessons = video_meta_df['lesson_id'].nunique()
-            st.metric("Unique Lessons", unique_lessons)
+            st.metric("Unique Lessons", int(meta_stats['lesson_id']))
         
         with col2:
-            unique_subjects = video_meta_df['_subject_title'].nunique()
-            st.metric("Unique Subjects", unique_subjects)
+            st.metric("Unique Subjects", int(meta_stats['_subject_title']))
         
         with col3:
-            avg_duration = video_meta_df['_duration'].mean()
-            st.metric("Average Duration (min)", f"{avg_duration/60:.1f}")
+            st.metric("Average Duration (min)", f"{meta_stats['_duration']/60:.1f}")
         
         # Subject distribution
-        subject_dist = video_meta_df['_subject_title'].value_counts().reset_index()
-        subject_dist.columns = ['Subject', 'Count']
+        subject_dist = top_slices(aggregates['subject_counts']).rename_axis('Subject').reset_index(name='Count')
         
         fig = px.pie(subject_dist, values='Count', names='Subject',
                     title='Video Distribution by Subject')
@@ -226,7 +285,7 @@ if all(df is not None for df in [video_license_df, lesson_test_df, video_meta_df
         
         # Display raw data
         st.subheader("Raw Video Meta Data")
-        st.dataframe(video_meta_df.head(100))
+        show_raw(video_meta_df)
     
     with tab4:
         st.header("Suspicious Activity Analysis")
@@ -242,20 +301,18 @@ if all(df is not None for df in [video_license_df, lesson_test_df, video_meta_df
             st.metric("Users with Alerts", unique_users_alerted)
         
         with col3:
-            high_risk_alerts = len(suspicious_activity_df[suspicious_activity_df['alert_level'] == 'high'])
+            high_risk_alerts = int((suspicious_activity_df['alert_level'] == 'high').sum())
             st.metric("High Risk Alerts", high_risk_alerts)
         
         # Alert level distribution
-        alert_dist = suspicious_activity_df['alert_level'].value_counts().reset_index()
-        alert_dist.columns = ['Alert Level', 'Count']
+        alert_dist = aggregates['alert_counts'].rename_axis('Alert Level').reset_index(name='Count')
         
         fig = px.pie(alert_dist, values='Count', names='Alert Level',
                     title='Alert Level Distribution')
         st.plotly_chart(fig, use_container_width=True)
         
         # Category distribution
-        category_dist = suspicious_activity_df['category'].value_counts().reset_index()
-        category_dist.columns = ['Category', 'Count']
+        category_dist = suspicious_activity_df['category'].value_counts().rename_axis('Category').reset_index(name='Count')
         
         fig2 = px.bar(category_dist, x='Category', y='Count',
                      title='Suspicious Activity by Category')
@@ -269,7 +326,7 @@ if all(df is not None for df in [video_license_df, lesson_test_df, video_meta_df
         
         # Display raw data
         st.subheader("Raw Suspicious Activity Data")
-        st.dataframe(suspicious_activity_df.head(100))
+        show_raw(suspicious_activity_df)
 
 else:
     st.warning("Please upload all four CSV files to begin analysis.")